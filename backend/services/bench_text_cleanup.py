@@ -0,0 +1,82 @@
+import os
+import re
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+from universal_extractor import strip_control_chars, iter_printable_runs
+
+def legacy_strip_control_chars(text):
+    return "".join(ch for ch in text if ch.isprintable() or ch in "\n\r\t")
+
+def legacy_scrape_strings(file_path):
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+        strings = re.findall(rb'[ -~]{6,}', raw)
+        return "\n".join(s.decode('ascii', errors='ignore') for s in strings if len(s) > 15)
+
+def scrape_strings(file_path):
+    return "\n".join(s.decode('ascii') for s in iter_printable_runs(file_path))
+
+def measure(fn, *args):
+    """Return (result, seconds, peak traced allocation in MB)."""
+    # Time and memory are measured in separate runs since tracing skews timings
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def make_text(n_chars, include_unicode):
+    rng = random.Random(0)
+    words = ["lorem", "ipsum", "dolor", "\x0c", "\x00", "\t", "\n", "café", "​", "naïve"]
+    ascii_words = [w for w in words if w.isascii()]
+    pool = words if include_unicode else ascii_words
+    parts, total = [], 0
+    while total < n_chars:
+        w = rng.choice(pool)
+        parts.append(w)
+        total += len(w) + 1
+    return " ".join(parts)
+
+def make_binary(path, n_bytes):
+    rng = random.Random(1)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < n_bytes:
+            block = bytearray(rng.randbytes(1 << 20))
+            # Sprinkle readable strings of varying length into the noise
+            for _ in range(200):
+                at = rng.randrange(0, len(block) - 64)
+                block[at:at + 40] = b"readable string inside a binary blob ok"[:rng.randint(4, 40)].ljust(40, b" ")
+            f.write(block)
+            written += len(block)
+
+def report(label, legacy, new):
+    (r_old, t_old, m_old), (r_new, t_new, m_new) = legacy, new
+    match = "same output" if r_old == r_new else "OUTPUT DIFFERS"
+    print(f"{label:<28} legacy {t_old:7.2f}s {m_old:8.1f}MB | new {t_new:7.2f}s {m_new:8.1f}MB | "
+          f"{t_old / t_new if t_new else float('inf'):5.1f}x faster, {match}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark text cleanup and binary string scraping")
+    parser.add_argument("--mb", type=int, default=200, help="Size of the synthetic binary file in MB")
+    parser.add_argument("--chars", type=int, default=20_000_000, help="Length of the synthetic text")
+    args = parser.parse_args()
+
+    for label, include_unicode in (("cleanup (ascii)", False), ("cleanup (mixed unicode)", True)):
+        text = make_text(args.chars, include_unicode)
+        report(label, measure(legacy_strip_control_chars, text), measure(strip_control_chars, text))
+
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        make_binary(path, args.mb * 1024 * 1024)
+        report(f"binary scrape ({args.mb}MB)", measure(legacy_scrape_strings, path), measure(scrape_strings, path))
+    finally:
+        os.remove(path)
@@ -0,0 +1,206 @@
+import sys
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+from universal_extractor import extract_text
+from rag_service import ingest_batch
+
+# Configure logging to stderr
+logging.basicConfig(level=logging.ERROR, stream=sys.stderr)
+
+MANIFEST_NAME = ".rag_ingest_manifest.json"
+
+# Each worker may load its own EasyOCR/torch model and runs a 4-thread OCR
+# pool for PDFs, so one process per CPU oversubscribes memory and cores.
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+def _extract_worker(file_path):
+    """Runs in a pool process: same routing as universal_extractor.main()."""
+    try:
+        return file_path, extract_text(file_path), None
+    except Exception as e:
+        return file_path, "", str(e)
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Manifest unreadable, starting fresh: {e}")
+    return {"files": {}}
+
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def file_signature(file_path):
+    st = os.stat(file_path)
+    return {"size": st.st_size, "mtime": int(st.st_mtime)}
+
+def collect_files(root):
+    """Walk the tree, skipping hidden files/dirs (including the manifest)."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if not name.startswith('.'):
+                paths.append(os.path.join(dirpath, name))
+    return paths
+
+def make_doc_id(rel_path):
+    return "bulk_" + hashlib.sha1(rel_path.encode('utf-8')).hexdigest()[:12]
+
+def bulk_ingest(root, manifest_path=None, workers=DEFAULT_WORKERS, batch_docs=32, retry_failed=False):
+    """
+    Extract every file under `root` in a process pool and ingest the results
+    in cross-document embedding batches. Finished files are checkpointed to a
+    manifest after each batch, so re-running resumes where it stopped.
+    Files whose extraction failed (including crashing a worker) are recorded
+    too and skipped on later runs unless they change or `retry_failed` is set.
+    """
+    root = os.path.abspath(root)
+    manifest_path = manifest_path or os.path.join(root, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    done = manifest["files"]
+
+    pending_paths = []
+    skipped = skipped_failed = 0
+    for path in collect_files(root):
+        rel = os.path.relpath(path, root)
+        entry = done.get(rel)
+        if entry and entry.get("size") == os.path.getsize(path) and entry.get("mtime") == int(os.path.getmtime(path)):
+            if "error" not in entry:
+                skipped += 1
+                continue
+            if not retry_failed:
+                skipped_failed += 1
+                continue
+        pending_paths.append(path)
+
+    stats = {"files": 0, "chunks": 0, "failed": 0, "skipped": skipped, "skipped_failed": skipped_failed}
+    batch = []
+    start = time.time()
+
+    def flush():
+        if not batch:
+            return
+        docs = [(text, make_doc_id(rel), rel) for rel, text, _ in batch]
+        try:
+            counts = ingest_batch(docs)
+        except Exception as e:
+            logging.error(f"Batch ingest failed ({len(batch)} files): {e}")
+            stats["failed"] += len(batch)
+            batch.clear()
+            return
+        for rel, _, sig in batch:
+            doc_id = make_doc_id(rel)
+            chunks = counts.get(doc_id, 0)
+            done[rel] = dict(sig, doc_id=doc_id, chunks=chunks)
+            stats["files"] += 1
+            stats["chunks"] += chunks
+        save_manifest(manifest, manifest_path)
+        batch.clear()
+        elapsed = max(time.time() - start, 1e-9)
+        print(f"[bulk] {stats['files']}/{len(pending_paths)} files, "
+              f"{stats['files'] / elapsed:.2f} files/s, {stats['chunks'] / elapsed:.2f} chunks/s",
+              file=sys.stderr)
+
+    def record_failure(path, error):
+        logging.error(f"Extraction failed for {path}: {error}")
+        done[os.path.relpath(path, root)] = dict(file_signature(path), error=error)
+        save_manifest(manifest, manifest_path)
+        stats["failed"] += 1
+
+    def consume(path, future):
+        try:
+            _, text, error = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            text, error = "", f"{type(e).__name__}: {e}"
+        if error:
+            record_failure(path, error)
+            return
+        rel = os.path.relpath(path, root)
+        batch.append((rel, text, file_signature(path)))
+        if len(batch) >= batch_docs:
+            flush()
+
+    def run_pool(queue, n_workers):
+        """
+        Drain `queue` through a pool, keeping a bounded window in flight so
+        finished futures (and their extracted text) are released once consumed.
+        If a worker dies, returns the paths that were in flight (the suspects).
+        """
+        in_flight = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            try:
+                while queue or in_flight:
+                    while queue and len(in_flight) < 2 * n_workers:
+                        path = queue.popleft()
+                        in_flight[executor.submit(_extract_worker, path)] = path
+                    finished, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        consume(in_flight[future], future)
+                        del in_flight[future]
+            except BrokenProcessPool:
+                # Futures that finished cleanly before the crash are still usable
+                suspects = []
+                for future, path in in_flight.items():
+                    if future.done() and not future.cancelled() and future.exception() is None:
+                        consume(path, future)
+                    else:
+                        suspects.append(path)
+                return suspects
+            except KeyboardInterrupt:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        return []
+
+    workers = workers or DEFAULT_WORKERS
+    queue = collections.deque(pending_paths)
+    try:
+        while queue:
+            suspects = run_pool(queue, workers)
+            # A worker died: rerun each suspect alone to find the file that crashes it
+            for path in suspects:
+                if run_pool(collections.deque([path]), 1):
+                    record_failure(path, "extraction worker crashed")
+    except KeyboardInterrupt:
+        # Keep whatever was already extracted; the rest resumes next run
+        logging.error("Interrupted, checkpointing finished files")
+    finally:
+        flush()
+
+    elapsed = time.time() - start
+    stats["seconds"] = round(elapsed, 2)
+    stats["files_per_sec"] = round(stats["files"] / elapsed, 2) if elapsed else 0.0
+    stats["chunks_per_sec"] = round(stats["chunks"] / elapsed, 2) if elapsed else 0.0
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory tree into the RAG store")
+    parser.add_argument("directory", help="Root directory to walk")
+    parser.add_argument("--manifest", help="Progress manifest path (default: <directory>/" + MANIFEST_NAME + ")")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Extraction processes (default: {DEFAULT_WORKERS}; each may load its own OCR model)")
+    parser.add_argument("--batch-docs", type=int, default=32, help="Documents per embedding/DB-write batch")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry files recorded as failed in the manifest")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(json.dumps({"error": "Directory not found", "success": False}))
+        sys.exit(1)
+
+    result = bulk_ingest(args.directory, args.manifest, args.workers, args.batch_docs, args.retry_failed)
+    print(json.dumps(dict(result, success=True)))
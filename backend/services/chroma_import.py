@@ -0,0 +1,372 @@
+import sys
+import os
+import json
+import mmap
+import heapq
+import pickle
+import random
+import sqlite3
+import struct
+import logging
+import argparse
+import numpy as np
+
+from rag_service import load_db, save_db, db_lock, _normalize_rows, EMBEDDING_DIM
+
+# Configure logging to stderr
+logging.basicConfig(level=logging.ERROR, stream=sys.stderr)
+
+CHROMA_DIR = os.path.join(os.path.dirname(__file__), "..", "chroma_db")
+
+# hnswlib header as persisted by Chroma: a persistence version int followed by
+# offsetLevel0, max_elements, cur_element_count, size_data_per_element,
+# label_offset, offsetData, maxlevel, enterpoint_node, maxM, maxM0, M, mult, ef_construction
+_HEADER_FORMAT = '<iQQQQQQiIQQQdQ'
+_DELETE_MARK = 0x01
+
+class _Stub:
+    """Stand-in for chromadb classes so index_metadata.pickle loads without chromadb."""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+
+class _StubUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module.startswith("chromadb"):
+            return _Stub
+        return super().find_class(module, name)
+
+class HnswSegment:
+    """
+    Read-only view of a Chroma HNSW segment directory (header.bin + data_level0.bin).
+    Vectors are read from an mmap in batches, so the segment is never fully loaded.
+    """
+
+    def __init__(self, segment_dir):
+        self.segment_dir = segment_dir
+        with open(os.path.join(segment_dir, "header.bin"), 'rb') as f:
+            header = f.read(struct.calcsize(_HEADER_FORMAT))
+        (self.version, self.offset_level0, self.max_elements, self.count,
+         self.size_per_element, self.label_offset, self.offset_data,
+         self.max_level, self.enterpoint, self.max_m, self.max_m0, self.m,
+         self.mult, self.ef_construction) = struct.unpack(_HEADER_FORMAT, header)
+        self.dim = (self.label_offset - self.offset_data) // 4
+
+        self._file = open(os.path.join(segment_dir, "data_level0.bin"), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self.count * self.size_per_element:
+            self._file.close()
+            raise ValueError(f"data_level0.bin holds {size} bytes, header expects {self.count} elements")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._dtype = np.dtype({
+            "names": ["links", "vector", "label"],
+            "formats": [("u1", self.offset_data), ("<f4", self.dim), "<u8"],
+            "offsets": [0, self.offset_data, self.label_offset],
+            "itemsize": self.size_per_element,
+        })
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def iter_batches(self, batch_size=1024):
+        """Yield (internal_ids, labels, vectors) for live elements, `batch_size` at a time."""
+        for start in range(0, self.count, batch_size):
+            n = min(batch_size, self.count - start)
+            raw = self._mm[start * self.size_per_element:(start + n) * self.size_per_element]
+            records = np.frombuffer(raw, dtype=self._dtype)
+            live = (records["links"][:, 2] & _DELETE_MARK) == 0
+            ids = np.arange(start, start + n)[live]
+            yield ids, records["label"][live].copy(), records["vector"][live].copy()
+
+    def vector(self, internal_id):
+        offset = internal_id * self.size_per_element + self.offset_data
+        return np.frombuffer(self._mm[offset:offset + self.dim * 4], dtype='<f4')
+
+    def is_deleted(self, internal_id):
+        return bool(self._mm[internal_id * self.size_per_element + 2] & _DELETE_MARK)
+
+    def label(self, internal_id):
+        return struct.unpack_from('<Q', self._mm, internal_id * self.size_per_element + self.label_offset)[0]
+
+    def neighbours(self, internal_id):
+        offset = internal_id * self.size_per_element
+        (header,) = struct.unpack_from('<I', self._mm, offset)
+        n = header & 0xFFFF
+        return struct.unpack_from(f'<{n}I', self._mm, offset + 4)
+
+def _distance(vectors, query_vec, space):
+    if space == "l2":
+        diff = vectors - query_vec
+        return np.einsum('ij,ij->i', diff, diff)
+    if space == "ip":
+        return 1.0 - vectors @ query_vec
+    # cosine
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vec) or 1.0)
+    norms[norms == 0] = 1.0
+    return 1.0 - (vectors @ query_vec) / norms
+
+def exact_search(segment, query_vec, k=5, space="l2", batch_size=1024, allowed_labels=None):
+    """
+    Brute-force k-NN over the segment, streaming it batch by batch. Only the
+    top k of each batch are kept and merged. Returns [(distance, label)].
+    """
+    best_d = np.empty(0, dtype=np.float32)
+    best_l = np.empty(0, dtype=np.uint64)
+    for _, labels, vectors in segment.iter_batches(batch_size):
+        if allowed_labels is not None:
+            keep = np.isin(labels, allowed_labels)
+            labels, vectors = labels[keep], vectors[keep]
+        dists = _distance(vectors, query_vec, space)
+        best_d = np.concatenate([best_d, dists])
+        best_l = np.concatenate([best_l, labels])
+        if len(best_d) > k:
+            top = np.argpartition(best_d, k)[:k]
+            best_d, best_l = best_d[top], best_l[top]
+    order = np.argsort(best_d)
+    return [(float(best_d[i]), int(best_l[i])) for i in order]
+
+def hnsw_search(segment, query_vec, k=5, ef=64, space="l2"):
+    """
+    Beam search over the level-0 graph from the entry point. Deleted nodes are
+    traversed but never returned. Returns [(distance, label)].
+    """
+    if segment.count == 0 or segment.enterpoint >= segment.count:
+        return []
+
+    def dist(node):
+        return float(_distance(segment.vector(node)[None, :], query_vec, space)[0])
+
+    start = segment.enterpoint
+    visited = {start}
+    candidates = [(dist(start), start)]
+    results = [] if segment.is_deleted(start) else [(-candidates[0][0], start)]
+    while candidates:
+        d, node = heapq.heappop(candidates)
+        if len(results) >= ef and d > -results[0][0]:
+            break
+        for nb in segment.neighbours(node):
+            if nb in visited or nb >= segment.count:
+                continue
+            visited.add(nb)
+            nd = dist(nb)
+            if len(results) < ef or nd < -results[0][0]:
+                heapq.heappush(candidates, (nd, nb))
+                if not segment.is_deleted(nb):
+                    heapq.heappush(results, (-nd, nb))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+    found = sorted((-d, node) for d, node in results)[:k]
+    return [(d, segment.label(node)) for d, node in found]
+
+def find_segments(chroma_dir=CHROMA_DIR):
+    return sorted(
+        os.path.join(chroma_dir, name) for name in os.listdir(chroma_dir)
+        if os.path.exists(os.path.join(chroma_dir, name, "header.bin"))
+    )
+
+def load_label_map(segment_dir):
+    """Map HNSW labels to Chroma embedding ids via index_metadata.pickle, if present."""
+    path = os.path.join(segment_dir, "index_metadata.pickle")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        data = _StubUnpickler(f).load()
+    state = data if isinstance(data, dict) else getattr(data, "__dict__", {})
+    return state.get("label_to_id")
+
+def find_metadata_segment(chroma_dir, vector_segment_id):
+    """
+    Resolve an HNSW segment directory name to the METADATA segment of the same
+    collection in chroma.sqlite3. Returns None if it cannot be resolved.
+    """
+    path = os.path.join(chroma_dir, "chroma.sqlite3")
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute(
+            "SELECT m.id FROM segments v JOIN segments m ON m.collection = v.collection "
+            "WHERE v.id = ? AND m.scope = 'METADATA'", (vector_segment_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def load_documents(chroma_dir, metadata_segment_id, embedding_ids):
+    """
+    Fetch document text and source for the given embedding ids from chroma.sqlite3.
+    Ids are only unique within a collection, so the lookup is limited to that
+    collection's metadata segment.
+    """
+    path = os.path.join(chroma_dir, "chroma.sqlite3")
+    if not os.path.exists(path) or not embedding_ids:
+        return {}
+    docs = {}
+    embedding_ids = list(embedding_ids)
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        # Stay under SQLite's default bound-parameter limit
+        for start in range(0, len(embedding_ids), 500):
+            batch = embedding_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT e.embedding_id, m.key, m.string_value FROM embeddings e "
+                f"JOIN embedding_metadata m ON m.id = e.id "
+                f"WHERE e.segment_id = ? AND e.embedding_id IN ({placeholders})",
+                [metadata_segment_id] + batch
+            )
+            for emb_id, key, value in rows:
+                doc = docs.setdefault(emb_id, {"text": None, "source": None})
+                if key == "chroma:document":
+                    doc["text"] = value
+                elif key in ("source", "filename") and value:
+                    doc["source"] = value
+    finally:
+        conn.close()
+    return docs
+
+def verify_graph(segment, sample_size=20, k=5, space="l2"):
+    """Compare HNSW graph results with exact search for a random sample of live vectors."""
+    live = [i for i in range(segment.count) if not segment.is_deleted(i)]
+    if not live:
+        return {"sampled": 0, "recall_at_k": None}
+    rng = random.Random(0)
+    sample = rng.sample(live, min(sample_size, len(live)))
+    hits = 0
+    for node in sample:
+        q = segment.vector(node).copy()
+        exact = {label for _, label in exact_search(segment, q, k, space)}
+        approx = {label for _, label in hnsw_search(segment, q, k, space=space)}
+        hits += len(exact & approx)
+    return {"sampled": len(sample), "recall_at_k": round(hits / (len(sample) * min(k, len(live))), 3)}
+
+def verify_store(segment, store, imported_labels, sample_size=20, k=5):
+    """
+    For a sample of imported vectors, compare the top-k neighbours that
+    rag_service.query() would rank from the vector store (dot product over
+    unit-normalised rows) with exact cosine search over the raw segment.
+    `imported_labels` maps embedding id -> HNSW label for the imported records.
+    """
+    records = [item for item in store if item["id"] in imported_labels]
+    if not records:
+        return {"sampled": 0, "recall_at_k": None}
+    matrix = _normalize_rows(np.asarray([item["embedding"] for item in records], dtype=np.float32))
+    ids = [item["id"] for item in records]
+    allowed = np.fromiter(imported_labels.values(), dtype=np.uint64)
+    rng = random.Random(0)
+    sample = rng.sample(range(len(records)), min(sample_size, len(records)))
+    kk = min(k, len(records))
+    hits = 0
+    for i in sample:
+        scores = matrix @ matrix[i]
+        store_top = {imported_labels[ids[j]] for j in np.argsort(-scores)[:kk]}
+        segment_top = {label for _, label in exact_search(segment, matrix[i], kk, "cosine", allowed_labels=allowed)}
+        hits += len(store_top & segment_top)
+    return {"sampled": len(sample), "recall_at_k": round(hits / (len(sample) * kk), 3)}
+
+def import_segment(segment_dir, chroma_dir=CHROMA_DIR, batch_size=1024, dry_run=False,
+                   sample_size=20, k=5):
+    """
+    Import a segment's vectors into the active vector store, then check the
+    store count and a sample of nearest neighbours against the segment.
+    Vectors without a recoverable document text are skipped, since query()
+    needs the text.
+    """
+    segment_id = os.path.basename(segment_dir)
+    report = {"segment": segment_id}
+    with HnswSegment(segment_dir) as segment:
+        report.update({"elements": segment.count, "dim": segment.dim})
+        # Imported vectors are searched with text-embedding-004 queries
+        if segment.dim != EMBEDDING_DIM:
+            report["error"] = f"dimension mismatch: query model is {EMBEDDING_DIM}-d, segment is {segment.dim}-d"
+            return report
+        if segment.count == 0:
+            report.update({"live": 0, "imported": 0, "skipped": 0})
+            return report
+
+        label_map = load_label_map(segment_dir)
+        if label_map is None:
+            report["error"] = "index_metadata.pickle missing; cannot map vectors to documents"
+            return report
+        metadata_segment_id = find_metadata_segment(chroma_dir, segment_id)
+        if metadata_segment_id is None:
+            report["error"] = "segment not found in chroma.sqlite3; cannot load documents"
+            return report
+
+        # Hold the store lock from load to the post-save count check so a
+        # concurrent ingest cannot drop these records or skew the count
+        with db_lock():
+            db = load_db()
+            before = len(db)
+            existing = {item["id"] for item in db}
+            imported_labels = {}
+            skipped = live = 0
+            for _, labels, vectors in segment.iter_batches(batch_size):
+                live += len(labels)
+                ids = [label_map.get(int(label)) for label in labels]
+                docs = load_documents(chroma_dir, metadata_segment_id, [i for i in ids if i])
+                for emb_id, label, vec in zip(ids, labels, vectors):
+                    doc = docs.get(emb_id)
+                    if not doc or not doc["text"] or emb_id in existing:
+                        skipped += 1
+                        continue
+                    db.append({
+                        "id": emb_id,
+                        "text": doc["text"],
+                        "embedding": vec.tolist(),
+                        "source": doc["source"] or "chroma_db"
+                    })
+                    existing.add(emb_id)
+                    imported_labels[emb_id] = int(label)
+
+            imported = len(imported_labels)
+            report.update({"live": live, "imported": imported, "skipped": skipped})
+            if not imported or dry_run:
+                return report
+
+            save_db(db)
+            store = load_db()
+            report["store_count"] = len(store)
+            if len(store) != before + imported:
+                report["error"] = f"store count {len(store)} != {before} existing + {imported} imported"
+                return report
+        report["store_verification"] = verify_store(segment, store, imported_labels, sample_size, k)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import vectors from the on-disk chroma_db HNSW segments")
+    parser.add_argument("--chroma_dir", default=CHROMA_DIR)
+    parser.add_argument("--space", default="l2", choices=["l2", "ip", "cosine"],
+                        help="Metric the HNSW index was built with (graph check only; the store is always checked by cosine)")
+    parser.add_argument("--sample", type=int, default=20, help="Vectors to check against exact search")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dry_run", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.chroma_dir):
+        print(json.dumps({"error": "chroma_db directory not found", "success": False}))
+        sys.exit(1)
+
+    reports = []
+    for segment_dir in find_segments(args.chroma_dir):
+        try:
+            report = import_segment(segment_dir, args.chroma_dir, dry_run=args.dry_run,
+                                    sample_size=args.sample, k=args.k)
+            with HnswSegment(segment_dir) as segment:
+                report["graph_verification"] = verify_graph(segment, args.sample, args.k, args.space)
+        except Exception as e:
+            report = {"segment": os.path.basename(segment_dir), "error": str(e)}
+        reports.append(report)
+    print(json.dumps({"success": True, "segments": reports}))
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import pytesseract
+
+def tesseract_text_and_confidence(image, lang='eng', config=r'--oem 3 --psm 6'):
+    """
+    Run Tesseract once and return (text, mean_word_confidence).
+    The text is Tesseract's own txt output, so layout options such as
+    preserve_interword_spaces still apply; the tsv output is read only for
+    the confidence. Confidence is None when no words were recognised.
+    """
+    with tempfile.TemporaryDirectory(prefix='tess_') as tmp:
+        input_path = os.path.join(tmp, 'input.png')
+        image.save(input_path, format='PNG')
+        out_base = os.path.join(tmp, 'out')
+        # 'txt' loads Tesseract's txt config; the -c flag adds the tsv renderer to the same run
+        pytesseract.pytesseract.run_tesseract(input_path, out_base, 'txt', lang,
+                                              config=f'{config} -c tessedit_create_tsv=1')
+        with open(out_base + '.txt', 'r', encoding='utf-8') as f:
+            text = f.read()
+        with open(out_base + '.tsv', 'r', encoding='utf-8') as f:
+            tsv = f.read()
+
+    confs = []
+    # tsv columns: level page block par line word left top width height conf text
+    for row in tsv.splitlines()[1:]:
+        cols = row.split('\t')
+        if len(cols) < 12 or not cols[11].strip():
+            continue
+        conf = float(cols[10])
+        if conf >= 0:
+            confs.append(conf)
+    return text, (sum(confs) / len(confs) if confs else None)
@@ -3,50 +3,84 @@ import os
 import json
 import logging
 import argparse
+import time
 import fitz  # PyMuPDF
 import io
-import pytesseract
 from PIL import Image
 import concurrent.futures
+from ocr_utils import tesseract_text_and_confidence
 
 # Configure logging
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def perform_ocr(image, lang='eng'):
+# Adaptive rendering: OCR every page at LOW_DPI first and only re-render the
+# pages where words were found but their mean confidence is below CONF_THRESHOLD.
+LOW_DPI = 150
+HIGH_DPI = 300
+CONF_THRESHOLD = 70
+
+def perform_ocr_with_confidence(image, lang='eng'):
     """
-    Perform OCR on a single image.
+    Perform OCR on a single image, returning (text, mean_word_confidence).
+    Confidence is None if no words were found.
     """
     try:
-        # Use tesseract to get structured data (HOCR or dict) if needed, 
-        # but for now we need raw text with some layout preservation.
         # preserve_interword_spaces=1 helps with simple tables.
         config = r'--oem 3 --psm 6 -c preserve_interword_spaces=1'
-        text = pytesseract.image_to_string(image, lang=lang, config=config)
-        return text
+        return tesseract_text_and_confidence(image, lang=lang, config=config)
     except Exception as e:
         logging.error(f"OCR failed: {e}")
-        return ""
+        return "", None
+
+def render_page(page, dpi):
+    """Render a PyMuPDF page to a PIL image at the given DPI."""
+    zoom = dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    image = Image.open(io.BytesIO(pix.tobytes("png")))
+    return image, pix.width * pix.height
+
+def _ocr_pages(images):
+    """OCR images in parallel, returning [(text, confidence)] in input order."""
+    results = [("", None)] * len(images)
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        future_to_index = {executor.submit(perform_ocr_with_confidence, img): i for i, img in enumerate(images)}
+        for future in concurrent.futures.as_completed(future_to_index):
+            index = future_to_index[future]
+            try:
+                results[index] = future.result()
+            except Exception as exc:
+                logging.error(f"Page {index+1} generated an exception: {exc}")
+    return results
 
-def process_pdf(pdf_path, output_path=None):
+def process_pdf(pdf_path, output_path=None, low_dpi=LOW_DPI, high_dpi=HIGH_DPI, conf_threshold=CONF_THRESHOLD):
     """
     Convert PDF pages to images and perform OCR on each page in parallel.
-    Returns structured JSON with page-wise content.
+    Pages are OCRed at `low_dpi` first; pages whose words score below
+    `conf_threshold` are re-rendered at `high_dpi` and OCRed again.
+    Returns structured JSON with page-wise content and an OCR cost report.
     """
     try:
-        # 1. Convert PDF to images using PyMuPDF (fitz)
-        images = []
+        start = time.time()
+
+        # 1. Convert PDF to images using PyMuPDF (fitz), low resolution pass
         try:
             doc = fitz.open(pdf_path)
+        except Exception as e:
+            print(json.dumps({"error": f"Failed to convert PDF to images: {str(e)}"}))
+            return
+
+        images = []
+        pixels_processed = 0
+        pixels_fixed_dpi = 0
+        try:
             for page in doc:
-                # 300 DPI = 300 / 72 ~= 4.166 zoom
-                zoom = 300 / 72
-                mat = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
+                image, pixels = render_page(page, low_dpi)
                 images.append(image)
-            doc.close()
+                pixels_processed += pixels
+                # What a fixed high_dpi render would have cost for comparison
+                pixels_fixed_dpi += int(page.rect.width * high_dpi / 72) * int(page.rect.height * high_dpi / 72)
         except Exception as e:
+            doc.close()
             print(json.dumps({"error": f"Failed to convert PDF to images: {str(e)}"}))
             return
 
@@ -56,36 +90,58 @@ def process_pdf(pdf_path, output_path=None):
             "full_text": ""
         }
 
-        # 2. Parallel OCR
-        # Adjust max_workers based on CPU cores.
-        results = [None] * len(images)
-        
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_index = {executor.submit(perform_ocr, img): i for i, img in enumerate(images)}
-            for future in concurrent.futures.as_completed(future_to_index):
-                index = future_to_index[future]
-                try:
-                    text = future.result()
-                    results[index] = text
-                except Exception as exc:
-                    logging.error(f"Page {index+1} generated an exception: {exc}")
-                    results[index] = ""
+        # 2. Parallel OCR at low DPI
+        results = _ocr_pages(images)
+
+        # 3. Re-render low-confidence pages at high DPI
+        page_dpi = [low_dpi] * len(results)
+        retry = []
+        if high_dpi > low_dpi:
+            # Pages without any words (blank, photos) would not improve at a higher DPI
+            retry = [i for i, (_, conf) in enumerate(results) if conf is not None and conf < conf_threshold]
+        if retry:
+            retry_images = []
+            for i in retry:
+                image, pixels = render_page(doc[i], high_dpi)
+                retry_images.append(image)
+                pixels_processed += pixels
+            for i, result in zip(retry, _ocr_pages(retry_images)):
+                if result[1] is not None and result[1] >= results[i][1]:
+                    results[i] = result
+                    page_dpi[i] = high_dpi
+        doc.close()
 
-        # 3. Aggregate results
+        # 4. Aggregate results
         full_text_parts = []
-        for i, text in enumerate(results):
+        for i, (text, conf) in enumerate(results):
             cid = i + 1
             cleaned_text = text.strip()
             page_data = {
                 "page_number": cid,
-                "content": cleaned_text
+                "content": cleaned_text,
+                "confidence": round(conf, 1) if conf is not None else None,
+                "dpi": page_dpi[i]
             }
             extracted_data["pages"].append(page_data)
             full_text_parts.append(f"--- Page {cid} ---\n{cleaned_text}")
         
         extracted_data["full_text"] = "\n\n".join(full_text_parts)
+
+        # OCR time scales roughly linearly with pixel count, so extrapolate
+        # the fixed-DPI cost from the measured seconds per pixel.
+        elapsed = time.time() - start
+        saved_pixels = max(pixels_fixed_dpi - pixels_processed, 0)
+        extracted_data["ocr_report"] = {
+            "low_dpi": low_dpi,
+            "high_dpi": high_dpi,
+            "pages_rerendered": len(retry),
+            "pixels_processed": pixels_processed,
+            "pixels_at_fixed_dpi": pixels_fixed_dpi,
+            "seconds": round(elapsed, 2),
+            "estimated_seconds_saved": round(elapsed * saved_pixels / pixels_processed, 2) if pixels_processed else 0.0
+        }
         
-        # 4. JSON Output
+        # 5. JSON Output
         if output_path:
             with open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(extracted_data, f, indent=2, ensure_ascii=False)
@@ -102,6 +158,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract text from PDF using OCR.")
     parser.add_argument("pdf_path", help="Path to the PDF file")
     parser.add_argument("--output", help="Optional path to save JSON output", default=None)
+    parser.add_argument("--low-dpi", type=int, default=LOW_DPI, help="First-pass render DPI")
+    parser.add_argument("--high-dpi", type=int, default=HIGH_DPI, help="Re-render DPI for low-confidence pages")
+    parser.add_argument("--conf-threshold", type=float, default=CONF_THRESHOLD, help="Mean word confidence (0-100) below which a page is re-rendered")
     
     args = parser.parse_args()
     
@@ -109,4 +168,4 @@ if __name__ == "__main__":
         print(json.dumps({"error": "File not found"}))
         sys.exit(1)
         
-    process_pdf(args.pdf_path, args.output)
+    process_pdf(args.pdf_path, args.output, args.low_dpi, args.high_dpi, args.conf_threshold)